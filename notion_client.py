@@ -3,8 +3,34 @@
 
     A simple Notion API Client that I coded for fun.
 """
-import requests
+import asyncio
+import importlib.util
 import json
+import httpx
+from types import ModuleType
+from typing import AsyncIterator, Optional, Tuple
+
+orjson: Optional[ModuleType]
+try:
+    import orjson
+except ImportError:  # orjson is optional, it only makes the serialization faster
+    orjson = None
+
+# h2 is optional too, without it the client falls back to HTTP/1.1
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Statuses and errors worth retrying: rate limited, temporarily unavailable or network failures
+RETRY_STATUSES = {429, 502, 503, 504}
+RETRY_ERRORS = (httpx.TransportError,)
+
+# A gateway error or a broken connection can come after the request was processed, only a
+# rate limited request or one that never reached the server is guaranteed not to be,
+# so they are the only ones a non-idempotent request retries
+NON_IDEMPOTENT_RETRY_STATUSES = {429}
+NON_IDEMPOTENT_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Notion queries can be slow, so reads get more time than httpx's 5 seconds default
+TIMEOUT = httpx.Timeout(60.0, connect=10.0)
 
 
 class GetDatabaseException(Exception):
@@ -28,13 +54,89 @@ class NotionAPIClient:
     A simple Notion API Client, fetching things (not all endpoints are implemented).
     """
 
-    def __init__(self, token):
+    def __init__(self, token: str, pool_size: int = 16, max_retries: int = 5):
         self.__token = token
+        self.__pool_size = pool_size
+        self.__max_retries = max_retries
         self.__headers = {
             "Authorization": f"Bearer {self.__token}",
             "Notion-Version": "2021-08-16",
             "Content-Type": "application/json",
         }
+        self.__session: Optional[httpx.AsyncClient] = None
+
+    @property
+    def _session(self) -> httpx.AsyncClient:
+        # All requests go through a single keep-alive pool so the TLS handshake is only paid once,
+        # and with HTTP/2 (when h2 is installed) concurrent requests are multiplexed on the same connection
+        if self.__session is None:
+            limits = httpx.Limits(max_connections=self.__pool_size, max_keepalive_connections=self.__pool_size)
+            self.__session = httpx.AsyncClient(http2=HTTP2, headers=self.__headers, limits=limits, timeout=TIMEOUT)
+        return self.__session
+
+    async def close(self) -> None:
+        """Closes the underlying HTTP session and its connection pool."""
+        if self.__session is not None:
+            await self.__session.aclose()
+            self.__session = None
+
+    async def __aenter__(self) -> "NotionAPIClient":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[dict] = None,
+        idempotent: bool = True,
+    ) -> Tuple[int, Optional[dict]]:
+        """Sends a request to the API, retrying when it is rate limited, unavailable or unreachable.
+
+        Args:
+            method (str): the HTTP method
+            url (str): the endpoint URL
+            body (dict, optional): the JSON body of the request
+            idempotent (bool, optional): whether the request can safely be sent twice, otherwise
+                it is only retried when it is certain that it was not processed
+
+        Returns:
+            Tuple[int, Optional[dict]]: the response status and its JSON content (None on errors)
+        """
+        # The body is serialized once to bytes, even if the request has to be retried
+        if body is None:
+            data = None
+        elif orjson is not None:
+            data = orjson.dumps(body)
+        else:
+            data = json.dumps(body).encode()
+
+        retry_statuses = RETRY_STATUSES if idempotent else NON_IDEMPOTENT_RETRY_STATUSES
+        retry_errors = RETRY_ERRORS if idempotent else NON_IDEMPOTENT_RETRY_ERRORS
+
+        attempt = 0
+        while True:
+            try:
+                response = await self._session.request(method, url, content=data)
+            except retry_errors:
+                if attempt == self.__max_retries:
+                    raise
+                delay = 0.3 * 2**attempt
+            else:
+                if response.status_code not in retry_statuses or attempt == self.__max_retries:
+                    content = response.json() if response.status_code == 200 else None
+                    return response.status_code, content
+
+                # Notion tells how long to wait on 429 (in seconds), otherwise back off exponentially
+                try:
+                    delay = float(response.headers["Retry-After"])
+                except (KeyError, ValueError):
+                    delay = 0.3 * 2**attempt
+
+            await asyncio.sleep(delay)
+            attempt += 1
 
     @classmethod
     def str_to_page_id(self, string: str) -> str:
@@ -44,7 +146,7 @@ class NotionAPIClient:
 
         return page_id
 
-    def get_database(self, database_id) -> dict:
+    async def get_database(self, database_id: str) -> dict:
         """Gets basic information about a database from its ID.
 
         Args:
@@ -56,14 +158,14 @@ class NotionAPIClient:
         # Database URL
         url = f"https://api.notion.com/v1/databases/{database_id}"
 
-        response = requests.get(url, headers=self.__headers)
+        status, content = await self._request("GET", url)
 
-        if response.status_code == 200:
-            return response.json()
+        if status == 200 and content is not None:
+            return content
         else:
-            raise GetDatabaseException(f"Error while getting database: {response.status_code}")
+            raise GetDatabaseException(f"Error while getting database: {status}")
 
-    def query_database(self, query: dict, database_id: str) -> dict:
+    async def query_database(self, query: dict, database_id: str) -> dict:
         """Queries in a given database.
 
         Args:
@@ -76,14 +178,39 @@ class NotionAPIClient:
 
         url = f"https://api.notion.com/v1/databases/{database_id}/query"
 
-        response = requests.request("POST", url=url, data=json.dumps(query), headers=self.__headers)
+        status, content = await self._request("POST", url, query)
 
-        if response.status_code == 200:
-            return response.json()
+        if status == 200 and content is not None:
+            return content
         else:
-            raise QueryDatabaseException(f"Error while querying database: {response.status_code}")
+            raise QueryDatabaseException(f"Error while querying database: {status}")
+
+    async def iter_query_database(self, query: dict, database_id: str) -> AsyncIterator[dict]:
+        """Queries in a given database and yields every result, following the pagination.
+
+        Notion returns at most 100 results per response, the next ones are
+        fetched with the cursor of the previous response.
+
+        Args:
+            query (dict): The query to execute.
+            database_id (str): The ID of the database to query.
+
+        Yields:
+            dict: A page of the query's results.
+        """
+
+        query = {**query, "page_size": 100}
+
+        while True:
+            response = await self.query_database(query, database_id)
+            for result in response["results"]:
+                yield result
+
+            if not response["has_more"]:
+                break
+            query["start_cursor"] = response["next_cursor"]
 
-    def get_page(self, page_id: str) -> dict:
+    async def get_page(self, page_id: str) -> dict:
         """Gets a page from its ID.
 
         Args:
@@ -95,23 +222,23 @@ class NotionAPIClient:
 
         url = f"https://api.notion.com/v1/pages/{page_id}"
 
-        response = requests.get(url, headers=self.__headers)
+        status, content = await self._request("GET", url)
 
-        if response.status_code == 200:
-            return response.json()
+        if status == 200 and content is not None:
+            return content
         else:
-            raise GetPageException(f"Error while retrieving the page: {response.status_code}")
+            raise GetPageException(f"Error while retrieving the page: {status}")
 
-    def create_page(self, page_data: str) -> None:
+    async def create_page(self, page_data: dict) -> None:
         """Creates a new page
 
         Args:
-            page_data (str): the page data dict
+            page_data (dict): the page data dict
         """
 
         url = f"https://api.notion.com/v1/pages"
 
-        response = requests.post(url, data=json.dumps(page_data), headers=self.__headers)
+        status, _ = await self._request("POST", url, page_data, idempotent=False)
 
-        if response.status_code != 200:
-            raise CreatePageException(f"Error while creating the page: {response.status_code}")
+        if status != 200:
+            raise CreatePageException(f"Error while creating the page: {status}")
@@ -4,26 +4,48 @@
     This python script aims to synchronize a Notion database with the Google Calendar API, in both directions.
 """
 from notion_client import *
+import asyncio
 import datetime
+import logging
 from dotenv import load_dotenv
 import os
 from dataclasses import dataclass
-from typing import List
+from typing import Any, Awaitable, Dict, List, Optional, Set
 from gcsa.event import Event
-from gcsa.google_calendar import GoogleCalendar
+from gcsa.google_calendar import GoogleCalendar, SendUpdatesMode
+from gcsa.serializers.event_serializer import EventSerializer
 
+log = logging.getLogger(__name__)
 
-@dataclass
+# Icon of the pages created from Google Calendar events
+DEFAULT_EMOJI = "\N{BLACK QUESTION MARK ORNAMENT}"
+
+
+@dataclass(slots=True)
 class SyncEvent:
     icon_emoji: str
     title: str
-    date_start: datetime.datetime
-    date_end: datetime.datetime
+    # Google Calendar all-day events are dates, the others are datetimes
+    date_start: datetime.date
+    date_end: datetime.date
     done: bool
     tags: List[str]
 
 
-def notion_event_to_sync_event(notion_event: dict) -> SyncEvent:
+def title_without_emoji(title: str) -> Optional[str]:
+    """Removes the emoji (first word) that prefixes the titles pushed to Google Calendar
+
+    Args:
+        title (str): An event title
+
+    Returns:
+        Optional[str]: The title without its first word, None if it has a single word
+    """
+    _, separator, rest = title.partition(" ")
+    return rest if separator else None
+
+
+def notion_event_to_sync_event(notion_event: Dict[str, Any]) -> SyncEvent:
     """Transforms a Notion event to a SyncEvent
 
     Args:
@@ -32,19 +54,18 @@ def notion_event_to_sync_event(notion_event: dict) -> SyncEvent:
     Returns:
         SyncEvent: A SyncEvent object
     """
-    x = SyncEvent(
+    properties = notion_event["properties"]
+    date = properties["Date"]["date"]
+    tags = [x["plain_text"] for x in properties["Tags"]["multi_select"] if "plain_text" in x]
+
+    return SyncEvent(
         icon_emoji=notion_event["icon"]["emoji"],
-        title=notion_event["properties"]["Calendar"]["title"][0]["plain_text"],
-        date_start=notion_event["properties"]["Date"]["date"]["start"],
-        date_end=notion_event["properties"]["Date"]["date"]["end"]
-        if notion_event["properties"]["Date"]["date"]["end"]
-        else notion_event["properties"]["Date"]["date"]["start"],
-        done=notion_event["properties"]["Done"]["checkbox"],
-        tags=[x["plain_text"] for x in notion_event["properties"]["Tags"]["multi_select"] if "plain_text" in x.keys()],
+        title=properties["Calendar"]["title"][0]["plain_text"],
+        date_start=datetime.datetime.fromisoformat(date["start"]),
+        date_end=datetime.datetime.fromisoformat(date["end"] or date["start"]),
+        done=properties["Done"]["checkbox"],
+        tags=tags or ["Unknown"],
     )
-    if x.tags == []:
-        x.tags = ["Unknown"]
-    return x
 
 
 def calendar_event_to_sync_event(calendar_event: Event) -> SyncEvent:
@@ -59,14 +80,14 @@ def calendar_event_to_sync_event(calendar_event: Event) -> SyncEvent:
     return SyncEvent(
         icon_emoji="",
         title=calendar_event.summary,
-        date_start=calendar_event.start.isoformat(),
-        date_end=calendar_event.end.isoformat(),
+        date_start=calendar_event.start,
+        date_end=calendar_event.end,
         done=False,
         tags=["Unknown"],
     )
 
 
-def fetch_notion_events(cli: NotionAPIClient, database_id: str) -> List[SyncEvent]:
+async def fetch_notion_events(cli: NotionAPIClient, database_id: str) -> List[SyncEvent]:
     """Fetches all events in the Notion database and turns them in SyncEvents
     ready to be synchronized
 
@@ -87,7 +108,7 @@ def fetch_notion_events(cli: NotionAPIClient, database_id: str) -> List[SyncEven
         }
     }
 
-    return [notion_event_to_sync_event(x) for x in cli.query_database(query, database_id)["results"]]
+    return [notion_event_to_sync_event(x) async for x in cli.iter_query_database(query, database_id)]
 
 
 def fetch_calendar_events(calendar: GoogleCalendar) -> List[SyncEvent]:
@@ -108,102 +129,177 @@ def fetch_calendar_events(calendar: GoogleCalendar) -> List[SyncEvent]:
     ]
 
 
-def push_events_to_notion(
-    cli: NotionAPIClient, database_id: str, pushed_events: List[SyncEvent], ignored_events: List[str]
+async def push_events_to_notion(
+    cli: NotionAPIClient,
+    database_id: str,
+    pushed_events: List[SyncEvent],
+    ignored_titles: Set[str],
+    max_concurrency: int = 3,
 ) -> None:
     """Pushes the Google calendar events to the Notion database
 
+    Pages are created concurrently, with at most `max_concurrency` requests
+    in flight (Notion allows around 3 requests per second).
+
     Args:
         cli (NotionAPIClient): the Notion client
         database_id (str): the database id
         pushed_events (List[SyncEvent]): the list of events to push
-        ignored_events (List[str]): the list of events to ignore
+        ignored_titles (Set[str]): the titles of the events to ignore
+        max_concurrency (int): the maximum number of concurrent requests
     """
 
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def push_page(title: str, notion_page: Dict[str, Any]) -> bool:
+        # A failing page must not cancel the rest of the batch
+        try:
+            async with semaphore:
+                await cli.create_page(notion_page)
+        except Exception as exception:
+            log.error("--> error: %s (%s)", title, exception)
+            return False
+        log.info("--> push: %s", title)
+        return True
+
+    # The parts of the page that are the same for every event are shared between pages
+    page_template = {
+        "parent": {"database_id": database_id},
+        "icon": {"type": "emoji", "emoji": DEFAULT_EMOJI},
+    }
+
+    tasks: List[Awaitable[bool]] = []
     for e in pushed_events:
         # We are ignoring events already in the database
         # In Notion emojis are not in the title but when I push back to
         # Google Agenda, they are in the title which means I have to test
         # the title and the title without emojis to check
-        if not any([e.title in x for x in ignored_events]) and not any(
-            [e.title.split(" ")[1] in x for x in ignored_events]
-        ):
+        stripped_title = title_without_emoji(e.title)
+        if e.title not in ignored_titles and (stripped_title is None or stripped_title not in ignored_titles):
 
             # Creating the page
             notion_page = {
-                "parent": {"database_id": database_id},
+                **page_template,
                 "properties": {
                     "Calendar": {"title": [{"text": {"content": e.title}}]},
                     "Done": {"checkbox": e.done},
-                    "Date": {"date": {"start": e.date_start, "end": e.date_end}},
+                    "Date": {"date": {"start": e.date_start.isoformat(), "end": e.date_end.isoformat()}},
                     "Tags": {"multi_select": [{"name": x} for x in e.tags]},
                 },
-                "icon": {"type": "emoji", "emoji": "❓"},
             }
 
             # Pushing the page
-            cli.create_page(notion_page)
-            print("--> push: {}".format(e.title))
+            tasks.append(push_page(e.title, notion_page))
         else:
-            print(f"--> ignore: {e.title}")
+            log.debug("--> ignore: %s", e.title)
+
+    pushed = sum(await asyncio.gather(*tasks))
+
+    log.info("--> %d pushed, %d ignored, %d failed", pushed, len(pushed_events) - len(tasks), len(tasks) - pushed)
 
 
 def push_events_to_calendar(
-    calendar: GoogleCalendar, pushed_events: List[SyncEvent], ignored_events: List[str]
+    calendar: GoogleCalendar, pushed_events: List[SyncEvent], ignored_titles: Set[str], batch_size: int = 50
 ) -> None:
     """Pushes the Notion events to the Google Calendar
 
+    The events are inserted with batch requests of `batch_size` events
+    (50 at most for the Calendar API), one round-trip per batch.
+
     Args:
         calendar (GoogleCalendar): GoogleCalendar instance from gcsa.google_calendar
         pushed_events (List[SyncEvent]): the list of events to push
-        ignored_events (List[str]): the list of events to ignore
+        ignored_titles (Set[str]): the titles of the events to ignore
+        batch_size (int): the number of events inserted per request
     """
 
+    calendar_events: List[Event] = []
+    titles: List[str] = []
+    errors = 0
+
+    # The request ids of the batches are the indexes of the events, to log each result with its title
+    def on_inserted(request_id: str, response: Dict[str, Any], exception: Optional[Exception]) -> None:
+        nonlocal errors
+        title = titles[int(request_id)]
+        if exception is not None:
+            errors += 1
+            log.error("--> error: %s (%s)", title, exception)
+        else:
+            log.info("--> push: %s", title)
+
     for e in pushed_events:
         # We are ignoring events already in the calendar
-        if not any([e.title in x for x in ignored_events]) and not any(
-            [e.title in x.split(" ") for x in ignored_events]
-        ):
+        if e.title not in ignored_titles:
             # Creating the event
             calendar_event = Event(
-                start=datetime.datetime.fromisoformat(e.date_start),
-                end=datetime.datetime.fromisoformat(e.date_end),
+                start=e.date_start,
+                end=e.date_end,
                 summary=str(e.icon_emoji + " " + e.title),
                 description=",".join(e.tags),
             )
-            calendar.add_event(calendar_event)
-            print("--> push: {}".format(e.title))
+            calendar_events.append(calendar_event)
+            titles.append(e.title)
         else:
-            print(f"--> ignore: {e.title}")
+            log.debug("--> ignore: %s", e.title)
+
+    # gcsa has no batch insert, so the batches are sent with its underlying Google API service
+    for i in range(0, len(calendar_events), batch_size):
+        batch = calendar.service.new_batch_http_request(callback=on_inserted)
+        for index in range(i, min(i + batch_size, len(calendar_events))):
+            # Same parameters as GoogleCalendar.add_event
+            request = calendar.service.events().insert(
+                calendarId=calendar.calendar,
+                body=EventSerializer.to_json(calendar_events[index]),
+                conferenceDataVersion=1,
+                sendUpdates=SendUpdatesMode.NONE,
+            )
+            batch.add(request, request_id=str(index))
+        batch.execute()
+
+    log.info(
+        "--> %d pushed, %d ignored, %d failed",
+        len(calendar_events) - errors,
+        len(pushed_events) - len(calendar_events),
+        errors,
+    )
+
 
+async def main() -> None:
 
-def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     # Loading the .env file
     load_dotenv()
-    token = os.getenv("TOKEN")
-    database_id = os.getenv("DATABASE_ID")
+    token = os.environ["TOKEN"]
+    database_id = os.environ["DATABASE_ID"]
 
-    # Getting Notion events from the database
-    print("[Fetching Notion events...]")
-    client = NotionAPIClient(token)
-    notion_events = fetch_notion_events(client, database_id)
-    print("--> {} events found".format(len(notion_events)))
-
-    # Getting Google Calendar events
-    print("[Fetching Google Calendar events...]")
     calendar = GoogleCalendar(credentials_path="./.credentials/credentials.json", calendar="primary")
-    calendar_events = fetch_calendar_events(calendar)
-    print("--> {} events found".format(len(calendar_events)))
 
-    # Synchronizing events
-    print("[Pushing events to Notion...]")
-    push_events_to_notion(client, database_id, calendar_events, [e.title for e in notion_events])
-    print("[Pushing events to Google Calendar...]")
-    push_events_to_calendar(calendar, notion_events, [e.title for e in calendar_events])
+    async with NotionAPIClient(token) as client:
+        # Getting Notion events from the database and Google Calendar events at the same time
+        # (gcsa is synchronous, so it runs in a thread)
+        log.info("[Fetching Notion and Google Calendar events...]")
+        notion_events, calendar_events = await asyncio.gather(
+            fetch_notion_events(client, database_id),
+            asyncio.to_thread(fetch_calendar_events, calendar),
+        )
+        log.info("--> %d Notion events found", len(notion_events))
+        log.info("--> %d Google Calendar events found", len(calendar_events))
+
+        # Titles already synchronized on each side, built once for constant time lookups
+        # Calendar titles are prefixed with the emoji, so they are also stored without it
+        notion_titles = {e.title for e in notion_events}
+        calendar_titles = {e.title for e in calendar_events}
+        calendar_titles.update([title_without_emoji(x) or x for x in calendar_titles])
+
+        # Synchronizing events
+        log.info("[Pushing events to Notion...]")
+        await push_events_to_notion(client, database_id, calendar_events, notion_titles)
+        log.info("[Pushing events to Google Calendar...]")
+        push_events_to_calendar(calendar, notion_events, calendar_titles)
 
-    print("[Synchronization completed.]")
+    log.info("[Synchronization completed.]")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())